@@ -1,57 +1,166 @@
 import sqlite3
 import os
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_file
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_file, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from flask_caching import Cache
+from flask_compress import Compress
+from flask_session import Session
 import re
+import math
+import functools
+import bisect
 import unicodedata
-from copy import deepcopy
 import threading
-import uuid
+import heapq
+import itertools
 import queue
 import time
-import random
-import string
+import secrets
+import types
+import json
+import orjson
+from collections import Counter
 from openpyxl import Workbook
 from io import BytesIO
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from contextlib import contextmanager
+import redis
+from psycopg2.extras import execute_values
+try:
+    from rapidfuzz import process
+    from rapidfuzz.distance import Levenshtein
+except ImportError:
+    # Fall back to the pure-Python edit distance below
+    process = Levenshtein = None
 from database import Database  # Our new database helper
 
+class OrJSONProvider(DefaultJSONProvider):
+    """jsonify() through orjson: faster, and accents go out as UTF-8 instead of \\u escapes"""
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_SORT_KEYS if self.sort_keys else 0
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = OrJSONProvider(app)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key')
+cache = Cache(app, config={'CACHE_TYPE': 'SimpleCache'})
+Compress(app)  # gzip JSON/HTML responses (sidebar polling)
+
+if os.environ.get('REDIS_URL'):
+    # Keep login sessions in Redis so every worker sees them; the cookie only carries the id
+    app.config['SESSION_TYPE'] = 'redis'
+    app.config['SESSION_REDIS'] = redis.Redis.from_url(os.environ['REDIS_URL'])
+    Session(app)
 
 # Initialize database
 db = Database()
 
 # --------- Database setup (PostgreSQL for production) ----------
+# The backend can't change while the process runs, so pick the SQL dialect once
+IS_POSTGRES = bool(os.environ.get('DATABASE_URL'))
+PARAM = '%s' if IS_POSTGRES else '?'
+
+if IS_POSTGRES:
+    SQL_CREATE_ORDERS = '''
+        CREATE TABLE IF NOT EXISTS confirmed_orders (
+            id SERIAL PRIMARY KEY,
+            user_id VARCHAR(255) NOT NULL,
+            session_id VARCHAR(255) NOT NULL,
+            product VARCHAR(255) NOT NULL,
+            quantity INTEGER NOT NULL,
+            status VARCHAR(20) DEFAULT 'pending',
+            order_group VARCHAR(255) DEFAULT 'main',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    '''
+    # Matches the per-user summary queries; INCLUDE makes them index-only scans
+    SQL_CREATE_ORDERS_INDEX = '''
+        CREATE INDEX IF NOT EXISTS idx_orders_user_status_group
+        ON confirmed_orders (user_id, status, order_group, product) INCLUDE (quantity)
+    '''
+    # Filled in by execute_values
+    SQL_INSERT_ORDERS = 'INSERT INTO confirmed_orders (user_id, session_id, product, quantity, status, order_group) VALUES %s'
+else:
+    SQL_CREATE_ORDERS = '''
+        CREATE TABLE IF NOT EXISTS confirmed_orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            session_id TEXT NOT NULL,
+            product TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            status TEXT DEFAULT 'pending',
+            order_group TEXT DEFAULT 'main',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    '''
+    SQL_CREATE_ORDERS_INDEX = '''
+        CREATE INDEX IF NOT EXISTS idx_orders_user_status_group
+        ON confirmed_orders (user_id, status, order_group, product, quantity)
+    '''
+    SQL_INSERT_ORDERS = 'INSERT INTO confirmed_orders (user_id, session_id, product, quantity, status, order_group) VALUES (?, ?, ?, ?, ?, ?)'
+
+SQL_MAIN_ORDERS = f'''
+    SELECT product, SUM(quantity) as total_quantity 
+    FROM confirmed_orders 
+    WHERE status = {PARAM} AND order_group = {PARAM} AND user_id = {PARAM}
+    GROUP BY product 
+    ORDER BY total_quantity DESC
+'''
+SQL_AUTO_ORDERS = f'''
+    SELECT order_group, product, quantity 
+    FROM confirmed_orders 
+    WHERE status = {PARAM} AND order_group != {PARAM} AND user_id = {PARAM}
+    ORDER BY order_group, product
+'''
+SQL_CONFIRM_AUTO_ORDER = f'''
+    UPDATE confirmed_orders SET status = {PARAM}, order_group = {PARAM}
+    WHERE order_group = {PARAM} AND status = {PARAM} AND user_id = {PARAM}
+'''
+SQL_DELETE_AUTO_ORDER = f'''
+    DELETE FROM confirmed_orders
+    WHERE order_group = {PARAM} AND status = {PARAM} AND user_id = {PARAM}
+'''
+
 def get_db_connection():
-    """Get database connection for existing order processing functions"""
-    database_url = os.environ.get('DATABASE_URL')
+    """Get database connection for existing order processing functions.
     
-    if database_url:
-        # Fix for Render's PostgreSQL URL
-        if database_url.startswith("postgres://"):
-            database_url = database_url.replace("postgres://", "postgresql://", 1)
-        
-        # Production - use PostgreSQL
-        conn = psycopg2.connect(database_url)
-        return conn
+    Pass it back with release_db_connection() when done.
+    """
+    if IS_POSTGRES:
+        # Production - borrow from the Database helper's pool (waits if it's exhausted)
+        return db.getconn()
     else:
         # Local development - use SQLite
         conn = sqlite3.connect('local_orders.db')
         conn.row_factory = sqlite3.Row
         return conn
 
+def release_db_connection(conn):
+    """Return a connection from get_db_connection() to the pool (or close it)"""
+    if IS_POSTGRES:
+        db.putconn(conn)
+    else:
+        conn.close()
+
+@contextmanager
+def db_conn():
+    """Borrow a database connection for the duration of a with-block"""
+    conn = get_db_connection()
+    try:
+        yield conn
+    finally:
+        release_db_connection(conn)
+
 def update_db_schema():
     """Update existing database schema to add missing columns"""
     conn = get_db_connection()
     cur = conn.cursor()
     
-    # Check if we're using PostgreSQL or SQLite
-    is_postgres = os.environ.get('DATABASE_URL') is not None
-    
     try:
         # Check if status column exists
-        if is_postgres:
+        if IS_POSTGRES:
             cur.execute("""
                 SELECT column_name 
                 FROM information_schema.columns 
@@ -61,14 +170,14 @@ def update_db_schema():
             cur.execute("PRAGMA table_info(confirmed_orders)")
             columns = [row[1] for row in cur.fetchall()]
         
-        if is_postgres:
+        if IS_POSTGRES:
             column_exists = cur.fetchone() is not None
         else:
             column_exists = 'status' in columns
             
         if not column_exists:
             print("Adding status column to confirmed_orders table...")
-            if is_postgres:
+            if IS_POSTGRES:
                 cur.execute("ALTER TABLE confirmed_orders ADD COLUMN status VARCHAR(20) DEFAULT 'confirmed'")
             else:
                 cur.execute("ALTER TABLE confirmed_orders ADD COLUMN status TEXT DEFAULT 'confirmed'")
@@ -78,7 +187,7 @@ def update_db_schema():
             print("Status column already exists")
             
         # Check if order_group column exists and its type
-        if is_postgres:
+        if IS_POSTGRES:
             cur.execute("""
                 SELECT column_name, data_type, character_maximum_length
                 FROM information_schema.columns 
@@ -88,7 +197,7 @@ def update_db_schema():
             cur.execute("PRAGMA table_info(confirmed_orders)")
             columns = {row[1]: row for row in cur.fetchall()}
         
-        if is_postgres:
+        if IS_POSTGRES:
             order_group_info = cur.fetchone()
             order_group_exists = order_group_info is not None
             if order_group_exists:
@@ -107,7 +216,7 @@ def update_db_schema():
             
         if not order_group_exists:
             print("Adding order_group column to confirmed_orders table...")
-            if is_postgres:
+            if IS_POSTGRES:
                 cur.execute("ALTER TABLE confirmed_orders ADD COLUMN order_group VARCHAR(255) DEFAULT 'main'")
             else:
                 cur.execute("ALTER TABLE confirmed_orders ADD COLUMN order_group TEXT DEFAULT 'main'")
@@ -121,7 +230,7 @@ def update_db_schema():
         conn.rollback()
     finally:
         cur.close()
-        conn.close()
+        release_db_connection(conn)
 
 def init_db():
     """Initialize database tables"""
@@ -129,81 +238,149 @@ def init_db():
         conn = get_db_connection()
         cur = conn.cursor()
         
-        # Check if we're using PostgreSQL or SQLite
-        is_postgres = os.environ.get('DATABASE_URL') is not None
-        
-        if is_postgres:
-            # PostgreSQL tables
-            cur.execute('''
-                CREATE TABLE IF NOT EXISTS confirmed_orders (
-                    id SERIAL PRIMARY KEY,
-                    session_id VARCHAR(255) NOT NULL,
-                    product VARCHAR(255) NOT NULL,
-                    quantity INTEGER NOT NULL,
-                    status VARCHAR(20) DEFAULT 'pending',
-                    order_group VARCHAR(255) DEFAULT 'main',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-        else:
-            # SQLite tables
-            cur.execute('''
-                CREATE TABLE IF NOT EXISTS confirmed_orders (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    session_id TEXT NOT NULL,
-                    product TEXT NOT NULL,
-                    quantity INTEGER NOT NULL,
-                    status TEXT DEFAULT 'pending',
-                    order_group TEXT DEFAULT 'main',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
+        cur.execute(SQL_CREATE_ORDERS)
+        cur.execute(SQL_CREATE_ORDERS_INDEX)
         
         conn.commit()
     except Exception as e:
         print(f"Database initialization error: {e}")
     finally:
         cur.close()
-        conn.close()
+        release_db_connection(conn)
+
+# Arbitrary key for the advisory lock that serializes schema setup across workers
+SCHEMA_LOCK_ID = 726354
+_db_initialized = False
+
+def setup_database():
+    """Run init_db() and update_db_schema() once per process.
+    
+    On PostgreSQL only the worker that wins the advisory lock runs them; the
+    others skip the DDL probes instead of racing on ALTER TABLE.
+    """
+    global _db_initialized
+    if _db_initialized:
+        return
+    _db_initialized = True
+    
+    if not IS_POSTGRES:
+        init_db()
+        update_db_schema()
+        return
+    
+    with db_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_try_advisory_lock(%s)", (SCHEMA_LOCK_ID,))
+        if cur.fetchone()[0]:
+            try:
+                init_db()
+                update_db_schema()
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (SCHEMA_LOCK_ID,))
+        else:
+            print("Schema setup running in another worker, skipping")
+        conn.commit()
+        cur.close()
 
 # Initialize database on startup
-init_db()
-update_db_schema()
+setup_database()
 
 # ---------- Core Order Processing Functions (UNCHANGED) ----------
+@functools.lru_cache(maxsize=4096)
 def normalize(text):
     text = text.lower()
     text = ''.join(c for c in unicodedata.normalize('NFD', text)
                    if unicodedata.category(c) != 'Mn')
     return text.strip() 
 
-def levenshtein_distance(a, b):
-    m, n = len(a), len(b)
-    if m == 0: return n
-    if n == 0: return m
-    dp = [[0] * (n + 1) for _ in range(m + 1)]
-    for i in range(m + 1):
-        dp[i][0] = i
-    for j in range(n + 1):
-        dp[0][j] = j    
-    for i in range(1, m + 1):
-        for j in range(1, n + 1):
-            cost = 0 if a[i - 1] == b[j - 1] else 1
-            dp[i][j] = min(
-                dp[i - 1][j] + 1,
-                dp[i][j - 1] + 1,
-                dp[i - 1][j - 1] + cost
-            )
-    return dp[m][n]
-
-def similarity_percentage(a, b):
-    a, b = normalize(a), normalize(b)
-    distance = levenshtein_distance(a, b)
+@functools.lru_cache(maxsize=4096)
+def _pattern_masks(pattern):
+    """Per-character bit masks of pattern for the bit-parallel edit distance"""
+    peq = {}
+    for i, c in enumerate(pattern):
+        peq[c] = peq.get(c, 0) | (1 << i)
+    return peq
+
+def _levenshtein_bit_parallel(text, pattern):
+    """Myers/Hyyrö bit-parallel edit distance: one pass over text, the DP
+    column for pattern packed into the bits of a single int."""
+    m = len(pattern)
+    if m == 0:
+        return len(text)
+    peq = _pattern_masks(pattern)
+    mask = (1 << m) - 1
+    last = 1 << (m - 1)
+    vp, vn, score = mask, 0, m
+    for c in text:
+        eq = peq.get(c, 0)
+        xv = eq | vn
+        xh = (((eq & vp) + vp) ^ vp) | eq
+        hp = vn | ~(xh | vp)
+        hn = vp & xh
+        if hp & last:
+            score += 1
+        elif hn & last:
+            score -= 1
+        hp = (hp << 1) | 1
+        hn <<= 1
+        vp = (hn | ~(xv | hp)) & mask
+        vn = hp & xv
+    return score
+
+def levenshtein_distance(a, b, score_cutoff=None):
+    """Edit distance; once it is known to exceed score_cutoff, returns score_cutoff + 1.
+    
+    Without rapidfuzz, b's bit masks are cached, so pass the catalog name as b.
+    """
+    if Levenshtein is not None:
+        return Levenshtein.distance(a, b, score_cutoff=score_cutoff)
+    distance = _levenshtein_bit_parallel(a, b)
+    if score_cutoff is not None and distance > score_cutoff:
+        return score_cutoff + 1
+    return distance
+
+def similarity_percentage(a, b, threshold=None, _normalized=False):
+    """Similarity in percent; with a threshold, scores below it may come back as 0"""
+    if not _normalized:
+        a, b = normalize(a), normalize(b)
     max_len = max(len(a), len(b))
     if max_len == 0:
         return 100.0
+    if threshold is None:
+        return (1 - levenshtein_distance(a, b) / max_len) * 100
+    # Largest edit distance that can still reach the threshold
+    max_distance = math.ceil(max_len * (100 - threshold) / 100)
+    if abs(len(a) - len(b)) > max_distance:
+        return 0.0
+    distance = levenshtein_distance(a, b, score_cutoff=max_distance)
+    if distance > max_distance:
+        return 0.0
     return (1 - distance / max_len) * 100
 
+# rapidfuzz turns a normalized score_cutoff into a distance bound with float
+# rounding, so a score exactly on the cutoff can be dropped
+SCORE_CUTOFF_EPSILON = 1e-6
+
+def best_match(query, choices, score_cutoff):
+    """Return (score, key) of the best choice scoring at least score_cutoff, or None.
+
+    choices maps keys to normalized names; ties go to the first choice.
+    """
+    if process is not None:
+        best = process.extractOne(query, choices,
+                                  scorer=Levenshtein.normalized_similarity,
+                                  score_cutoff=score_cutoff / 100 - SCORE_CUTOFF_EPSILON)
+        if best is None or best[1] * 100 < score_cutoff:
+            return None
+        return best[1] * 100, best[2]
+
+    best = None
+    for key, choice in choices.items():
+        score = similarity_percentage(query, choice, threshold=score_cutoff, _normalized=True)
+        if score >= score_cutoff and (best is None or score > best[0]):
+            best = (score, key)
+    return best
+
 units = {
     "0":0, "1":1, "2":2, "3":3, "4":4, "5":5, "6":6, "7":7, "8":8, "9":9,
     "zero":0, "um":1, "uma":1, "dois":2, "duas":2, "dos":2, "tres":3, "tres":3, "treis": 3,
@@ -249,24 +426,28 @@ def parse_number_words(tokens):
             i += 1
     return total if total > 0 else None
 
+# Compound teens are split out even when glued to other words ("dezesseisovos");
+# every other number word only at word boundaries, in one alternation (longest first).
+_GLUED_TEENS = ("dezesseis", "dezessete", "dezoito", "dezenove")
+_GLUED_TEEN_RE = re.compile("|".join(_GLUED_TEENS))
+_WORDNUM_RE = re.compile(
+    r"\b(?:" +
+    "|".join(re.escape(w) for w in sorted(word2num_all, key=len, reverse=True) if w not in _GLUED_TEENS) +
+    r")\b"
+)
+_DIGIT_WORD_RE = re.compile(r"(\d+)([a-zA-Z])")
+_WORD_DIGIT_RE = re.compile(r"([a-zA-Z])(\d+)")
+_PUNCT_RE = re.compile(r"[,\.;\+\-\/\(\)\[\]\:]")
+_WS_RE = re.compile(r"\s+")
+
 def separate_numbers_and_words(text):
     """Insert spaces between digit-word and between number-words glued to words."""
     text = text.lower()
-    text = re.sub(r"(\d+)([a-zA-Z])", r"\1 \2", text)
-    text = re.sub(r"([a-zA-Z])(\d+)", r"\1 \2", text)
-
-    # Protect compound teen numbers so they don't get split
-    protected_teens = ["dezesseis", "dezessete", "dezoito", "dezenove"]
-    for teen in protected_teens:
-        text = text.replace(teen, f" {teen} ")
-
-    # Now process other number words normally
-    keys = sorted(word2num_all.keys(), key=len, reverse=True)
-    for w in keys:
-        if w not in protected_teens:
-            text = re.sub(rf"\b{re.escape(w)}\b", f" {w} ", text)
-
-    text = re.sub(r"\s+", " ", text).strip()
+    text = _DIGIT_WORD_RE.sub(r"\1 \2", text)
+    text = _WORD_DIGIT_RE.sub(r"\1 \2", text)
+    text = _GLUED_TEEN_RE.sub(lambda m: f" {m.group(0)} ", text)
+    text = _WORDNUM_RE.sub(lambda m: f" {m.group(0)} ", text)
+    text = _WS_RE.sub(" ", text).strip()
     return text
 
 def extract_numbers_and_positions(tokens):
@@ -303,73 +484,61 @@ def extract_numbers_and_positions(tokens):
             
     return numbers
 
-def find_associated_number(product_position, all_tokens, numbers_with_positions):
-    """Find the number associated with a product based on word order patterns"""
+def find_associated_number(product_position, all_tokens, numbers_with_positions, number_positions=None):
+    """Find the number associated with a product based on word order patterns.
+    
+    number_positions is the sorted list of positions in numbers_with_positions;
+    pass it in to avoid rebuilding it for every product in a message.
+    """
     if not numbers_with_positions:
         return 1, None
+    if number_positions is None:
+        number_positions = [pos for pos, _ in numbers_with_positions]
+    
+    # Pattern 1/2: closest number before the product (e.g. "2 mangas")
+    idx = bisect.bisect_left(number_positions, product_position)
+    if idx > 0:
+        pos, val = numbers_with_positions[idx - 1]
+        return val, pos
     
-    # Pattern 1: Number immediately before the product (most common)
-    if product_position > 0:
-        prev_token = all_tokens[product_position - 1]
-        if prev_token.isdigit() or prev_token in word2num_all:
-            for pos, val in numbers_with_positions:
-                if pos == product_position - 1:
-                    return val, pos
-    
-    # Pattern 2: Look for numbers before the product (anywhere before)
-    numbers_before = [(pos, val) for pos, val in numbers_with_positions if pos < product_position]
-    if numbers_before:
-        # Return the closest number before the product (highest position number before product)
-        closest_before = max(numbers_before, key=lambda x: x[0])
-        return closest_before[1], closest_before[0]
-    
-    # Pattern 3: Number immediately after the product
-    if product_position + 1 < len(all_tokens):
-        next_token = all_tokens[product_position + 1]
-        if next_token.isdigit() or next_token in word2num_all:
-            for pos, val in numbers_with_positions:
-                if pos == product_position + 1:
-                    return val, pos
-    
-    # Pattern 4: Look for numbers after the product (anywhere after)
-    numbers_after = [(pos, val) for pos, val in numbers_with_positions if pos > product_position]
-    if numbers_after:
-        # Return the closest number after the product (lowest position number after product)
-        closest_after = min(numbers_after, key=lambda x: x[0])
-        return closest_after[1], closest_after[0]
+    # Pattern 3/4: closest number after the product (e.g. "mangas 2")
+    idx = bisect.bisect_right(number_positions, product_position)
+    if idx < len(number_positions):
+        pos, val = numbers_with_positions[idx]
+        return val, pos
     
     return 1, None
 
-def parse_order_interactive(message, products_db, similarity_threshold=80, uncertain_range=(60, 80)):
+# Words skipped between products unless they are part of a product name
+FILLER_WORDS = frozenset({"quero", "e"})
+
+@functools.lru_cache(maxsize=4096)
+def parse_order_interactive(message, similarity_threshold=80, uncertain_range=(60, 80)):
     """
     Interactive version that uses pattern-based quantity association with multi-word product support.
     Fixed to handle multiple products with quantities in the same message.
+    
+    Returns (parsed_orders, deltas), where deltas maps product name -> quantity
+    to add; apply it to a session's order dict with apply_deltas().
+    Results are memoized per message (the catalog is fixed) and shared between
+    sessions, so they come back as read-only views.
     """
     message = normalize(message)
     message = separate_numbers_and_words(message)
-    message = re.sub(r"[,\.;\+\-\/\(\)\[\]\:]", " ", message)
-    message = re.sub(r"\s+", " ", message).strip()
+    message = _PUNCT_RE.sub(" ", message)
+    message = _WS_RE.sub(" ", message).strip()
 
     tokens = message.split()
     
-    # Start with the current database state (accumulate items)
-    working_db = deepcopy(products_db)
+    # Quantities to add per product name (accumulate items)
+    deltas = {}
     parsed_orders = []
 
     # Extract all numbers and their positions
     numbers_with_positions = extract_numbers_and_positions(tokens)
+    sorted_number_positions = [pos for pos, _ in numbers_with_positions]
     
-    # Sort products by word count (longest first) to prioritize multi-word matches
-    product_names = [p for p, _ in products_db]
-    sorted_products = sorted([(p, i) for i, p in enumerate(product_names)], 
-                           key=lambda x: len(x[0].split()), reverse=True)
-    max_prod_words = max(len(p.split()) for p in product_names)
-
-    # Precompute the set of words that appear in any product name
-    product_words = set()
-    for product in product_names:
-        for word in product.split():
-            product_words.add(normalize(word))
+    number_positions = set(sorted_number_positions)
 
     used_positions = set()  # Track used token positions
     used_numbers = set()    # Track used number positions
@@ -383,15 +552,14 @@ def parse_order_interactive(message, products_db, similarity_threshold=80, uncer
         token = tokens[i]
 
         # Skip filler words and numbers only if they are not part of a product name
-        filler_words = {"quero", "e"}
-        if (token in filler_words and token not in product_words) or (token.isdigit() and i not in [pos for pos, _ in numbers_with_positions]) or token in word2num_all:
+        if (token in FILLER_WORDS and token not in NORMALIZED_PRODUCT_WORDS) or (token.isdigit() and i not in number_positions) or token in word2num_all:
             i += 1
             continue
 
         matched = False
         
         # Try different phrase lengths (longest first) - prioritize multi-word products
-        for size in range(min(max_prod_words, 4), 0, -1):
+        for size in range(min(MAX_PRODUCT_WORDS, 4), 0, -1):
             if i + size > len(tokens):
                 continue
                 
@@ -403,7 +571,7 @@ def parse_order_interactive(message, products_db, similarity_threshold=80, uncer
                     skip_phrase = True
                     break
                 t = tokens[i+j]
-                if (t.isdigit() or t in word2num_all or (t in filler_words and t not in product_words)):
+                if (t.isdigit() or t in word2num_all or (t in FILLER_WORDS and t not in NORMALIZED_PRODUCT_WORDS)):
                     skip_phrase = True
                     break
                     
@@ -413,23 +581,34 @@ def parse_order_interactive(message, products_db, similarity_threshold=80, uncer
             phrase = " ".join(phrase_tokens)
             phrase_norm = normalize(phrase)
 
-            best_score = 0
-            best_product = None
-            best_original_idx = None
-            
-            # Find best match for this phrase length (check against sorted products)
-            for idx, (prod_name, orig_idx) in enumerate(sorted_products):
-                prod_norm = normalize(prod_name)
-                score = similarity_percentage(phrase_norm, prod_norm)
-                if score > best_score:
-                    best_score = score
-                    best_product = prod_name
-                    best_original_idx = orig_idx
+            # Exact catalog names need no scoring: one dict hit, and nothing
+            # can beat 100%
+            exact_idx = EXACT_PRODUCT_LOOKUP.get(phrase_norm)
+            if exact_idx is not None:
+                best = (100.0, exact_idx)
+            else:
+                # Score products sharing a word (or a word prefix) with the phrase first;
+                # the whole catalog is scored when those give no match (typos can
+                # split or change a word's first letters)
+                candidates = set()
+                for t in phrase_tokens:
+                    candidates.update(PRODUCT_TOKEN_INDEX.get(t, ()))
+                    candidates.update(PRODUCT_TOKEN_INDEX.get(t[:3], ()))
+                best = None
+                if candidates:
+                    choices = {idx: norm for idx, norm in SORTED_PRODUCT_CHOICES.items() if idx in candidates}
+                    # The cutoff lets the scorer skip products that can't reach the threshold
+                    best = best_match(phrase_norm, choices, similarity_threshold)
+                if best is None:
+                    best = best_match(phrase_norm, SORTED_PRODUCT_CHOICES, similarity_threshold)
 
             # Handle the match
-            if best_score >= similarity_threshold:
+            if best is not None:
+                best_score, best_original_idx = best
+                best_product = PRODUCT_NAMES[best_original_idx]
+
                 # Find associated number for this product
-                quantity, number_position = find_associated_number(i, tokens, numbers_with_positions)
+                quantity, number_position = find_associated_number(i, tokens, numbers_with_positions, sorted_number_positions)
                 
                 # If number position is already used, try to find another number
                 if number_position is not None and number_position in used_numbers:
@@ -440,8 +619,8 @@ def parse_order_interactive(message, products_db, similarity_threshold=80, uncer
                             number_position = pos
                             break
                 
-                # Update the working database (add to existing quantity)
-                working_db[best_original_idx][1] += quantity
+                # Record the quantity to add to this product
+                deltas[best_product] = deltas.get(best_product, 0) + quantity
                 parsed_orders.append({"product": best_product, "qty": quantity, "score": round(best_score,2)})
                 
                 # Mark positions as used
@@ -457,21 +636,15 @@ def parse_order_interactive(message, products_db, similarity_threshold=80, uncer
         if not matched:
             # If no match found, find the best match to suggest
             phrase = tokens[i]
-            best_match = None
-            best_score = 0
-            best_original_idx = None
             phrase_norm = normalize(phrase)
             
-            for idx, product in enumerate(product_names):
-                score = similarity_percentage(phrase_norm, normalize(product))
-                if score > best_score:
-                    best_score = score
-                    best_match = product
-                    best_original_idx = idx
+            best = best_match(phrase_norm, ALL_PRODUCT_CHOICES, 50)
             
-            if best_match and best_score > 50:
+            if best is not None and best[0] > 50:
+                best_score, best_original_idx = best
+                matched_product = PRODUCT_NAMES[best_original_idx]
                 # Auto-confirm reasonable matches for web version
-                quantity, number_position = find_associated_number(i, tokens, numbers_with_positions)
+                quantity, number_position = find_associated_number(i, tokens, numbers_with_positions, sorted_number_positions)
                 
                 # If number position is already used, try to find another number
                 if number_position is not None and number_position in used_numbers:
@@ -481,10 +654,10 @@ def parse_order_interactive(message, products_db, similarity_threshold=80, uncer
                             number_position = pos
                             break
                 
-                # Update the working database (add to existing quantity)
-                working_db[best_original_idx][1] += quantity
+                # Record the quantity to add to this product
+                deltas[matched_product] = deltas.get(matched_product, 0) + quantity
                 parsed_orders.append({
-                    "product": best_match,
+                    "product": matched_product,
                     "qty": quantity,
                     "score": round(best_score, 2)
                 })
@@ -497,7 +670,13 @@ def parse_order_interactive(message, products_db, similarity_threshold=80, uncer
             
             i += 1
 
-    return parsed_orders, working_db
+    return (tuple(types.MappingProxyType(order) for order in parsed_orders),
+            types.MappingProxyType(deltas))
+
+def apply_deltas(db, deltas):
+    """Add the quantities returned by parse_order_interactive to a product -> qty dict"""
+    for product, qty in deltas.items():
+        db[product] += qty
 
 # ---------- Initialize products_db ----------
 products_db = [
@@ -508,125 +687,237 @@ products_db = [
     ["caixa de ovos", 0], ["ovo", 0], ["queijo", 0]
 ]
 
+# Product names never change at runtime, so normalize them once for matching
+PRODUCT_NAMES = [p for p, _ in products_db]
+NORMALIZED_PRODUCT_NAMES = [normalize(p) for p in PRODUCT_NAMES]
+# Empty order (every product at 0); sessions copy it instead of rebuilding the list
+EMPTY_ORDER = dict.fromkeys(PRODUCT_NAMES, 0)
+MAX_PRODUCT_WORDS = max(len(p.split()) for p in PRODUCT_NAMES)
+NORMALIZED_PRODUCT_WORDS = {normalize(w) for p, _ in products_db for w in p.split()}
+ALL_PRODUCT_CHOICES = dict(enumerate(NORMALIZED_PRODUCT_NAMES))
+# Same choices ordered by word count (longest first) to prioritize multi-word matches
+SORTED_PRODUCT_CHOICES = {
+    i: NORMALIZED_PRODUCT_NAMES[i]
+    for i in sorted(range(len(PRODUCT_NAMES)), key=lambda i: len(PRODUCT_NAMES[i].split()), reverse=True)
+}
+
+if Levenshtein is None:
+    # Warm the bit-mask cache for the pure-Python edit distance
+    for _name in NORMALIZED_PRODUCT_NAMES:
+        _pattern_masks(_name)
+
+# Normalized name -> product index, for matching well-spelled phrases without scoring
+EXACT_PRODUCT_LOOKUP = {}
+for _idx, _name in SORTED_PRODUCT_CHOICES.items():
+    EXACT_PRODUCT_LOOKUP.setdefault(_name, _idx)
+
+# Inverted index: normalized product word (and its 3-letter prefix) -> product indices
+PRODUCT_TOKEN_INDEX = {}
+for _idx, _name in enumerate(NORMALIZED_PRODUCT_NAMES):
+    for _word in _name.split():
+        for _key in {_word, _word[:3]}:
+            PRODUCT_TOKEN_INDEX.setdefault(_key, []).append(_idx)
+
 # ---------- Enhanced OrderBot with Database Persistence ----------
 user_sessions = {}
 session_lock = threading.Lock()
+resumed_sessions = set()  # Redis mode: sessions whose timers this process already resumed
+SESSION_SNAPSHOT_TTL = 24 * 60 * 60  # seconds an idle session survives in Redis
+SESSION_LOCK_TTL = 10  # seconds before a crashed worker's session lock expires
+STREAM_KEEPALIVE = 15  # seconds between heartbeats on an idle /stream connection
+
+# Chat commands, matched against each message's words
+CONFIRM_WORDS = frozenset({'confirmar', 'sim', 's'})
+CANCEL_WORDS = frozenset({'cancelar', 'nao', 'não', 'n'})
+READY_WORDS = frozenset({'pronto', 'confirmar'})
+# Matched as substrings anywhere in the message (some span two words)
+CANCEL_COMMANDS = ('cancelar', 'hoje não', 'hoje nao')
+# Short replies whose answer OrderSession.process_message may reuse when repeated
+MEMO_COMMANDS = CONFIRM_WORDS | CANCEL_WORDS | READY_WORDS | {'1', '2'}
+
+# ---------- Session timers ----------
+# One daemon thread serves every session's inactivity/reminder timers from a
+# heap of (deadline, seq, session, timer_gen, callback). Cancelling a timer just
+# bumps session.timer_gen, and stale entries are dropped when they come due.
+_SCHED_HEAP = []
+_SCHED_COND = threading.Condition()
+_sched_seq = itertools.count()
+_sched_thread = None
+
+def _scheduler_loop():
+    while True:
+        with _SCHED_COND:
+            while not _SCHED_HEAP or _SCHED_HEAP[0][0] > time.monotonic():
+                timeout = _SCHED_HEAP[0][0] - time.monotonic() if _SCHED_HEAP else None
+                _SCHED_COND.wait(timeout)
+            _, _, session_obj, timer_gen, callback = heapq.heappop(_SCHED_HEAP)
+        
+        if session_obj.timer_gen != timer_gen:
+            continue  # cancelled or replaced
+        try:
+            with locked_session(session_obj):
+                # Another worker may have moved the session on since this was scheduled
+                if session_obj.timer_gen == timer_gen:
+                    callback()
+        except Exception as e:
+            print(f"Timer callback error: {e}")
+
+def _schedule(session_obj, delay, callback):
+    """Run callback after delay seconds unless session_obj cancels its timer first"""
+    global _sched_thread
+    with _SCHED_COND:
+        # Started lazily so a forked worker gets its own thread
+        if _sched_thread is None or not _sched_thread.is_alive():
+            _sched_thread = threading.Thread(target=_scheduler_loop, name="session-timers", daemon=True)
+            _sched_thread.start()
+        heapq.heappush(_SCHED_HEAP, (time.monotonic() + delay, next(_sched_seq),
+                                     session_obj, session_obj.timer_gen, callback))
+        _SCHED_COND.notify()
+
+@cache.memoize(timeout=10)
+def _fetch_orders(user_id):
+    """Get all confirmed orders from database with separate auto-confirmed groups.
+    
+    Cached per user; call _invalidate_orders() after writing to confirmed_orders.
+    """
+    with db_conn() as conn:
+        cur = conn.cursor()
+    
+        # Get main confirmed orders (blue boxes) - filter by user_id
+        cur.execute(SQL_MAIN_ORDERS, ('confirmed', 'main', user_id))
+        main_orders_data = cur.fetchall()
+    
+        # Get auto-confirmed order groups (yellow boxes) - filter by user_id
+        cur.execute(SQL_AUTO_ORDERS, ('auto_confirmed', 'main', user_id))
+        auto_orders_data = cur.fetchall()
+        cur.close()
+    
+    # Process main orders (blue)
+    main_orders = {}
+    for row in main_orders_data:
+        product = row[0]
+        quantity = row[1]
+        if product and quantity:
+            main_orders[product] = quantity
+    
+    # Process auto orders (yellow boxes grouped by order_group)
+    auto_orders = {}
+    for row in auto_orders_data:
+        order_group = row[0]
+        product = row[1]
+        quantity = row[2]
+        
+        if order_group not in auto_orders:
+            auto_orders[order_group] = {}
+        
+        auto_orders[order_group][product] = quantity
+    
+    return {
+        'main_orders': main_orders,
+        'auto_orders': auto_orders
+    }
+
+def _invalidate_orders(user_id):
+    """Drop a user's cached orders after confirmed_orders changes"""
+    cache.delete_memoized(_fetch_orders, user_id)
 
 class OrderSession:
+    __slots__ = ('session_id', 'user_id', 'products_db', 'current_db', 'confirmed_orders',
+                 'pending_orders', 'state', 'reminder_count', 'message_queue', 'timer_gen',
+                 'last_activity', 'waiting_for_option', '_last_msg', '_last_result', '_published_rev')
+
     def __init__(self, session_id, user_id):
         self.session_id = session_id
         self.user_id = user_id
-        self.products_db = deepcopy(products_db)
-        self.current_db = deepcopy(products_db)
+        self.products_db = EMPTY_ORDER
+        self.current_db = EMPTY_ORDER.copy()
         self.confirmed_orders = []
         self.pending_orders = []
         
         self.state = "waiting_for_next"
         self.reminder_count = 0
         self.message_queue = queue.Queue()
-        self.active_timer = None
+        self.timer_gen = 0
         self.last_activity = time.time()
         self.waiting_for_option = False
+        self._last_msg = None
+        self._last_result = None
+        self._published_rev = 0
+
+    def save_snapshot(self):
+        """Store the conversation state in Redis so another worker (or a restart) can resume it"""
+        if db.redis is None:
+            return
+        key = f"sess:{self.session_id}"
+        pipe = db.redis.pipeline()
+        pipe.hset(key, mapping={
+            'user_id': self.user_id,
+            'state': self.state,
+            'current_db': json.dumps(self.current_db),
+            'pending_orders': json.dumps(self.pending_orders),
+            'confirmed_orders': json.dumps(self.confirmed_orders),
+            'reminder_count': self.reminder_count,
+            'timer_gen': self.timer_gen,
+            'published_rev': self._published_rev
+        })
+        pipe.expire(key, SESSION_SNAPSHOT_TTL)
+        pipe.execute()
+
+    def load_snapshot(self):
+        """Restore state saved by save_snapshot(). Returns False if there is none"""
+        if db.redis is None:
+            return False
+        data = db.redis.hgetall(f"sess:{self.session_id}")
+        if not data:
+            return False
+        self.state = data['state']
+        self.current_db = json.loads(data['current_db'])
+        self.pending_orders = json.loads(data['pending_orders'])
+        self.confirmed_orders = json.loads(data['confirmed_orders'])
+        self.reminder_count = int(data['reminder_count'])
+        self.timer_gen = int(data.get('timer_gen', 0))
+        self._published_rev = int(data.get('published_rev', 0))
+        self.waiting_for_option = self.state == "option"
+        return True
+
+    def resume_timers(self):
+        """Restart the inactivity/reminder cycle of a restored session (timers are per process).
+        
+        Scheduled at the saved timer_gen, so whichever worker's copy of a timer
+        fires first runs it and the rest find the generation moved on.
+        """
+        if self.state == "collecting":
+            _schedule(self, 5.0, self._send_summary)
+        elif self.state == "confirming":
+            _schedule(self, 5.0, self._send_reminder)
 
     def _save_final_orders(self, orders_list, status="confirmed", order_group="main"):
         """Save orders with order_group support"""
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Check if we're using PostgreSQL or SQLite
-        is_postgres = os.environ.get('DATABASE_URL') is not None
+        rows = [
+            (self.user_id, self.session_id, product, qty, status, order_group)
+            for order in orders_list
+            for product, qty in order.items()
+            if qty > 0
+        ]
+        if not rows:
+            return
         
-        for order in orders_list:
-            for product, qty in order.items():
-                if qty > 0:
-                    if is_postgres:
-                        cur.execute(
-                            'INSERT INTO confirmed_orders (user_id, session_id, product, quantity, status, order_group) VALUES (%s, %s, %s, %s, %s, %s)',
-                            (self.user_id, self.session_id, product, qty, status, order_group)
-                        )
-                    else:
-                        cur.execute(
-                            'INSERT INTO confirmed_orders (user_id, session_id, product, quantity, status, order_group) VALUES (?, ?, ?, ?, ?, ?)',
-                            (self.user_id, self.session_id, product, qty, status, order_group)
-                        )
-        
-        conn.commit()
-        cur.close()
-        conn.close()
+        with db_conn() as conn:
+            cur = conn.cursor()
+            
+            # One statement for the whole batch instead of a round trip per row
+            if IS_POSTGRES:
+                execute_values(cur, SQL_INSERT_ORDERS, rows, page_size=500)
+            else:
+                cur.executemany(SQL_INSERT_ORDERS, rows)
+            
+            conn.commit()
+            cur.close()
+        _invalidate_orders(self.user_id)
 
     def get_global_orders(self):
         """Get all confirmed orders from database with separate auto-confirmed groups"""
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Check if we're using PostgreSQL or SQLite
-        is_postgres = os.environ.get('DATABASE_URL') is not None
-        
-        # Get main confirmed orders (blue boxes) - filter by user_id
-        if is_postgres:
-            cur.execute('''
-                SELECT product, SUM(quantity) as total_quantity 
-                FROM confirmed_orders 
-                WHERE status = %s AND order_group = %s AND user_id = %s
-                GROUP BY product 
-                ORDER BY total_quantity DESC
-            ''', ('confirmed', 'main', self.user_id))
-        else:
-            cur.execute('''
-                SELECT product, SUM(quantity) as total_quantity 
-                FROM confirmed_orders 
-                WHERE status = ? AND order_group = ? AND user_id = ?
-                GROUP BY product 
-                ORDER BY total_quantity DESC
-            ''', ('confirmed', 'main', self.user_id))
-        
-        main_orders_data = cur.fetchall()
-        
-        # Get auto-confirmed order groups (yellow boxes) - filter by user_id
-        if is_postgres:
-            cur.execute('''
-                SELECT order_group, product, quantity 
-                FROM confirmed_orders 
-                WHERE status = %s AND order_group != %s AND user_id = %s
-                ORDER BY order_group, product
-            ''', ('auto_confirmed', 'main', self.user_id))
-        else:
-            cur.execute('''
-                SELECT order_group, product, quantity 
-                FROM confirmed_orders 
-                WHERE status = ? AND order_group != ? AND user_id = ?
-                ORDER BY order_group, product
-            ''', ('auto_confirmed', 'main', self.user_id))
-        
-        auto_orders_data = cur.fetchall()
-        
-        # Process main orders (blue)
-        main_orders = {}
-        for row in main_orders_data:
-            product = row[0]
-            quantity = row[1]
-            if product and quantity:
-                main_orders[product] = quantity
-        
-        # Process auto orders (yellow boxes grouped by order_group)
-        auto_orders = {}
-        for row in auto_orders_data:
-            order_group = row[0]
-            product = row[1]
-            quantity = row[2]
-            
-            if order_group not in auto_orders:
-                auto_orders[order_group] = {}
-            
-            auto_orders[order_group][product] = quantity
-        
-        cur.close()
-        conn.close()
-        
-        return {
-            'main_orders': main_orders,
-            'auto_orders': auto_orders
-        }
+        return _fetch_orders(self.user_id)
 
     def get_all_orders_summary(self):
         """Get summary of all orders from database (for Excel download)"""
@@ -635,33 +926,25 @@ class OrderSession:
     # ... (rest of your OrderSession methods remain exactly the same)
     def start_new_conversation(self):
         """Reset for a new conversation and wait for next message"""
-        self.current_db = deepcopy(self.products_db)
+        self.current_db = self.products_db.copy()
         self.state = "waiting_for_next"
         self.reminder_count = 0
         self.waiting_for_option = False
         self._cancel_timer()
-        self.message_queue.put("🔄 **Conversa reiniciada!**")
+        self.notify("🔄 **Conversa reiniciada!**")
         
-    def add_item(self, parsed_orders):
+    def add_item(self, deltas):
         """Add parsed items to current database - simplified"""
-        for order in parsed_orders:
-            for idx, (product, _) in enumerate(self.current_db):
-                if product == order["product"]:
-                    self.current_db[idx][1] += order["qty"]
-                    break
+        apply_deltas(self.current_db, deltas)
         
         self.state = "collecting"
         self._start_inactivity_timer()
 
-    def reset_cycle(self, parsed_orders):
+    def reset_cycle(self, deltas):
         """Reset cycle and add items during confirmation phase - simplified"""
         self._cancel_timer()
         
-        for order in parsed_orders:
-            for idx, (product, _) in enumerate(self.current_db):
-                if product == order["product"]:
-                    self.current_db[idx][1] += order["qty"]
-                    break
+        apply_deltas(self.current_db, deltas)
         
         self.state = "collecting"
         self.reminder_count = 0
@@ -670,15 +953,11 @@ class OrderSession:
     def _start_inactivity_timer(self):
         """Start 30-second inactivity timer"""
         self._cancel_timer()
-        self.active_timer = threading.Timer(5.0, self._send_summary)
-        self.active_timer.daemon = True
-        self.active_timer.start()
+        _schedule(self, 5.0, self._send_summary)
     
     def _cancel_timer(self):
         """Cancel active timer"""
-        if self.active_timer:
-            self.active_timer.cancel()
-            self.active_timer = None
+        self.timer_gen += 1
     
     def _send_summary(self):
         """Send summary and start confirmation cycle"""
@@ -686,7 +965,7 @@ class OrderSession:
             self.state = "confirming"
             self.reminder_count = 0
             summary = self._build_summary()
-            self.message_queue.put(summary)
+            self.notify(summary)
             self._start_reminder_cycle()
         elif self.state == "collecting":
             self._start_inactivity_timer()
@@ -695,24 +974,20 @@ class OrderSession:
         """Start reminder cycle - first reminder after 30 seconds"""
         self.reminder_count = 1
         self._cancel_timer()
-        self.active_timer = threading.Timer(5.0, self._send_reminder)
-        self.active_timer.daemon = True
-        self.active_timer.start()
+        _schedule(self, 5.0, self._send_reminder)
 
     def _send_reminder(self):
         """Send a reminder"""
         if self.state == "confirming" and self.reminder_count <= 5:
             summary = self._build_summary()
-            self.message_queue.put(f"🔔 **LEMBRETE ({self.reminder_count}/5):**\n{summary}")
+            self.notify(f"🔔 **LEMBRETE ({self.reminder_count}/5):**\n{summary}")
             
             if self.reminder_count == 5:
                 self._mark_as_pending()
             else:
                 self.reminder_count += 1
                 self._cancel_timer()
-                self.active_timer = threading.Timer(5.0, self._send_reminder)
-                self.active_timer.daemon = True
-                self.active_timer.start()
+                _schedule(self, 5.0, self._send_reminder)
                 
     
     def _mark_as_pending(self):
@@ -720,17 +995,13 @@ class OrderSession:
         if self.has_items():
             auto_order = self.get_current_orders()
             # Generate shorter unique order group ID
-            import random
-            import string
-            timestamp = str(int(time.time()))[-6:]  # Last 6 digits of timestamp
-            random_part = ''.join(random.choices(string.ascii_lowercase + string.digits, k=6))
-            order_group_id = f"auto_{timestamp}_{random_part}"
+            order_group_id = f"auto_{secrets.token_urlsafe(8)}"
             
             # Save as auto-confirmed with unique group
             self._save_final_orders([auto_order], status="auto_confirmed", order_group=order_group_id)
-            self.message_queue.put("🟡 **PEDIDO CONFIRMADO AUTOMATICAMENTE** - O pedido foi salvo e aguarda sua confirmação final na barra lateral.")
             self._reset_current()
             self.state = "waiting_for_next"  # Go back to waiting_for_next state
+            self.notify("🟡 **PEDIDO CONFIRMADO AUTOMATICAMENTE** - O pedido foi salvo e aguarda sua confirmação final na barra lateral.")
 
     def _build_summary(self):
         """Build summary message"""
@@ -743,14 +1014,28 @@ class OrderSession:
     
     def _check_cancel_command(self, message_lower):
         """Check if message contains cancel commands"""
-        cancel_commands = ['cancelar', 'hoje não', 'hoje nao']
-        return any(command in message_lower for command in cancel_commands)
+        return any(command in message_lower for command in CANCEL_COMMANDS)
     
     def process_message(self, message):
         """Process incoming message"""
         message_lower = message.lower().strip()
         self.last_activity = time.time()
         
+        # Every transition changes the state or the timer generation, so while
+        # both are unchanged a repeated command gets the same answer
+        memo_key = (self.state, self.timer_gen, message_lower)
+        if memo_key == self._last_msg:
+            return self._last_result
+        
+        result = self._handle_message(message, message_lower)
+        if message_lower in MEMO_COMMANDS and (self.state, self.timer_gen) == memo_key[:2]:
+            self._last_msg, self._last_result = memo_key, result
+        return result
+    
+    def _handle_message(self, message, message_lower):
+        """Run message through the conversation state machine"""
+        tokens = message_lower.split()
+        
         # Check for cancel commands in ANY state
         if self._check_cancel_command(message_lower):
             self.start_new_conversation()
@@ -793,7 +1078,7 @@ class OrderSession:
         
         # Handle pending confirmation state
         if self.state == "pending_confirmation":
-            if any(word in message_lower.split() for word in ['confirmar', 'sim', 's']):
+            if not CONFIRM_WORDS.isdisjoint(tokens):
                 if self.pending_orders:
                     self.confirmed_orders.extend(self.pending_orders)
                     self._save_final_orders(self.pending_orders)
@@ -805,7 +1090,7 @@ class OrderSession:
                         'success': True,
                         'message': f"✅ **PEDIDO PENDENTE CONFIRMADO!** {pending_count} pedido(s) adicionado(s) à lista."
                     }
-                elif any(word in message_lower.split() for word in ['cancelar', 'nao', 'não', 'n']):
+                elif not CANCEL_WORDS.isdisjoint(tokens):
                     # Add cancellation logic here - clear pending orders and reset state
                     self.pending_orders = []
                     self.state = "collecting"
@@ -822,8 +1107,8 @@ class OrderSession:
             else:
                 self.state = "collecting"
                 self._start_inactivity_timer()
-                parsed_orders, updated_db = parse_order_interactive(message, self.current_db)
-                self.current_db = updated_db
+                parsed_orders, deltas = parse_order_interactive(message)
+                apply_deltas(self.current_db, deltas)
                 if parsed_orders:
                     return {'success': True}
                 else:
@@ -831,7 +1116,7 @@ class OrderSession:
         
         # Handle confirmation state
         if self.state == "confirming":
-            if any(word in message_lower.split() for word in ['confirmar', 'sim', 's']):
+            if not CONFIRM_WORDS.isdisjoint(tokens):
                 self._cancel_timer()
                 confirmed_order = self.get_current_orders()
                 self.confirmed_orders.append(confirmed_order)
@@ -848,7 +1133,7 @@ class OrderSession:
                     'success': True,
                     'message': response
                 }
-            elif any(word in message_lower.split() for word in ['nao', 'não', 'n']):
+            elif not CANCEL_WORDS.isdisjoint(tokens):
                 self._cancel_timer()
                 self._reset_current()
                 self._start_inactivity_timer()
@@ -857,9 +1142,9 @@ class OrderSession:
                     'message': "🔄 **Lista limpa!** Digite novos itens."
                 }
             else:
-                parsed_orders, updated_db = parse_order_interactive(message, self.current_db)
+                parsed_orders, deltas = parse_order_interactive(message)
                 if parsed_orders:
-                    self.current_db = updated_db
+                    apply_deltas(self.current_db, deltas)
                     self._cancel_timer()
                     self.state = "collecting"
                     self.reminder_count = 0
@@ -873,15 +1158,15 @@ class OrderSession:
         
         # Handle collection state
         elif self.state in ["collecting"]:
-            if message_lower in ['pronto', 'confirmar']:
+            if message_lower in READY_WORDS:
                 if self.has_items():
                     self._send_summary()
                     return {'success': True, 'message': "📋 Preparando seu resumo..."}
                 else:
                     return {'success': False, 'message': "❌ Lista vazia. Adicione itens primeiro."}
             else:
-                parsed_orders, updated_db = parse_order_interactive(message, self.current_db)
-                self.current_db = updated_db
+                parsed_orders, deltas = parse_order_interactive(message)
+                apply_deltas(self.current_db, deltas)
                 if parsed_orders:
                     self._start_inactivity_timer()
                     return {'success': True}
@@ -893,19 +1178,35 @@ class OrderSession:
         
     def has_items(self):
         """Check if there are any items in the order"""
-        return any(qty > 0 for _, qty in self.current_db)
+        return any(self.current_db.values())
     
     def get_current_orders(self):
         """Get current orders as dict"""
-        return {product: qty for product, qty in self.current_db if qty > 0}
+        return {product: qty for product, qty in self.current_db.items() if qty}
     
     def _reset_current(self):
         """Reset current session (temp items) completely"""
-        self.current_db = deepcopy(self.products_db)
+        self.current_db = self.products_db.copy()
         self.state = "collecting"
         self.reminder_count = 0
         self._cancel_timer()
     
+    def notify(self, message=None):
+        """Push a bot message and/or the session's new state to /stream listeners.
+        
+        With Redis the update is published on channel:{session_id}, so a listener
+        on any worker receives it; otherwise messages wait in the local queue.
+        Nothing drains that queue when Redis is on, so polling /get_updates
+        gets state but no bot messages then; use /stream.
+        """
+        if db.redis is not None:
+            # Listeners got everything up to the last published rev (or the full list on connect)
+            payload = _session_payload(self, message, since=self._published_rev)
+            self._published_rev = payload['rev']
+            db.redis.publish(f"channel:{self.session_id}", app.json.dumps(payload))
+        elif message is not None:
+            self.message_queue.put(message)
+    
     def get_pending_message(self):
         """Get pending message if any"""
         try:
@@ -914,16 +1215,107 @@ class OrderSession:
             return None
 
 def get_user_session(user_id, session_id=None):
-    """Get or create user session"""
+    """Get or create user session.
+    
+    With Redis the snapshot is the session: every call builds a fresh copy
+    from it, and changes go through locked_session(). Otherwise sessions live
+    in this process's user_sessions.
+    """
+    if not session_id:
+        session_id = secrets.token_hex(16)
+    
+    if db.redis is not None:
+        session_obj = OrderSession(session_id, user_id)
+        restored = session_obj.load_snapshot()
+        with session_lock:
+            first_seen = session_id not in resumed_sessions
+            resumed_sessions.add(session_id)
+        # Pick up the cycle of a session left by a restarted or other worker
+        if restored and first_seen:
+            session_obj.resume_timers()
+        return session_obj
+    
+    # Returning sessions are found without taking the lock
+    session_obj = user_sessions.get(session_id)
+    if session_obj is not None:
+        return session_obj
     with session_lock:
-        if not session_id:
-            session_id = str(uuid.uuid4())
-        
-        if session_id not in user_sessions:
-            user_sessions[session_id] = OrderSession(session_id, user_id)
-        return user_sessions[session_id]
+        return user_sessions.setdefault(session_id, OrderSession(session_id, user_id))
+
+@contextmanager
+def locked_session(session_obj):
+    """Serialize changes to a session across workers: load -> process -> save.
+    
+    With Redis this holds sess_lock:{session_id} (SET NX) while the snapshot is
+    reloaded, changed and saved back. Without Redis it is a no-op.
+    """
+    if db.redis is None:
+        yield session_obj
+        return
+    with db.redis.lock(f"sess_lock:{session_obj.session_id}", timeout=SESSION_LOCK_TTL, sleep=0.02):
+        session_obj.load_snapshot()
+        yield session_obj
+        session_obj.save_snapshot()
+
+def _confirmed_orders_update(session_obj, since=None):
+    """confirmed_orders for a response: the whole list, or only what came after rev `since`.
+    
+    The list only grows during a session, so its length is the revision.
+    """
+    confirmed = session_obj.confirmed_orders
+    if not isinstance(since, int):
+        return {'confirmed_orders': confirmed, 'rev': len(confirmed)}
+    since = min(max(since, 0), len(confirmed))
+    return {'confirmed_orders_delta': confirmed[since:], 'since': since, 'rev': len(confirmed)}
+
+def _session_payload(session_obj, message=None, since=None):
+    """Session state as sent by /get_updates and /stream"""
+    payload = {
+        'state': session_obj.state,
+        'current_orders': session_obj.get_current_orders(),
+        'pending_orders': session_obj.pending_orders,
+        'reminders_sent': session_obj.reminder_count,
+        'has_message': message is not None,
+        **_confirmed_orders_update(session_obj, since)
+    }
+    if message is not None:
+        payload['bot_message'] = message
+    return payload
+
+def _stream_updates(session_obj):
+    """Yield Server-Sent Events for a session until the client disconnects"""
+    if db.redis is not None:
+        # Subscribe before sending the snapshot so nothing published in between is lost
+        pubsub = db.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(f"channel:{session_obj.session_id}")
+        try:
+            yield f"data: {app.json.dumps(_session_payload(session_obj))}\n\n"
+            while True:
+                update = pubsub.get_message(timeout=STREAM_KEEPALIVE)
+                if update is None:
+                    yield ": keepalive\n\n"
+                else:
+                    yield f"data: {update['data']}\n\n"
+        finally:
+            pubsub.close()
+    else:
+        yield f"data: {app.json.dumps(_session_payload(session_obj))}\n\n"
+        rev = len(session_obj.confirmed_orders)
+        while True:
+            # Doubles as a periodic state refresh when nothing is queued
+            try:
+                message = session_obj.message_queue.get(timeout=STREAM_KEEPALIVE)
+            except queue.Empty:
+                message = None
+            yield f"data: {app.json.dumps(_session_payload(session_obj, message, since=rev))}\n\n"
+            rev = len(session_obj.confirmed_orders)
 
 # ---------- Flask routes ----------
+def _request_json():
+    """JSON object sent with the request, or {} when the body is missing, invalid or not an object"""
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else {}
+
 @app.route('/')
 def index():
     if 'user_id' not in session:
@@ -936,31 +1328,26 @@ def index():
                          user=user_data,
                          session_id=user_id)
 
+LOGIN_HTML = '''
+    <form method="post">
+        <h2>Login</h2>
+        <input type="email" name="email" placeholder="Enter your email" required>
+        <button type="submit">Login</button>
+    </form>
+    '''
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         email = request.form.get('email')
-        user = db.get_user_by_email(email)
+        user, is_new_user = db.login_or_create(email)
         
-        if not user:
-            # Create new user
-            user_id = str(uuid.uuid4())
-            db.create_user(user_id, email)
-            session['user_id'] = user_id
-            session['is_new_user'] = True
-        else:
-            session['user_id'] = user['id']
-            session['is_new_user'] = False
+        session['user_id'] = user['id']
+        session['is_new_user'] = is_new_user
         
         return redirect(url_for('index'))
     
-    return '''
-    <form method="post">
-        <h2>Login</h2>
-        <input type="email" name="email" placeholder="Enter your email" required>
-        <button type="submit">Login</button>
-    </form>
-    '''
+    return LOGIN_HTML
 
 @app.route('/get_qr_status')
 def get_qr_status():
@@ -976,35 +1363,26 @@ def get_qr_status():
         'is_new_user': session.get('is_new_user', False)
     })
 
-@app.route('/save_whatsapp_session', methods=['POST'])
-def save_whatsapp_session():
-    """Mark user's WhatsApp as ready"""
-    if 'user_id' not in session:
-        return jsonify({'error': 'Not logged in'})
-    
-    user_id = session['user_id']
-    db.update_whatsapp_status(user_id, True)
-    
-    return jsonify({'success': True})
-
 # Your existing API routes
 @app.route("/send_message", methods=["POST"])
 def send_message():
-    data = request.json
+    data = _request_json()
     message = data.get("message", "").strip()
     user_id = data.get("user_id") or session.get('user_id', "default")
     
     if not message:
         return jsonify({'error': 'Mensagem vazia'})
     
-    session_obj = get_user_session(user_id)
-    result = session_obj.process_message(message)
+    session_obj = get_user_session(user_id, data.get("session_id"))
+    with locked_session(session_obj):
+        result = session_obj.process_message(message)
+        session_obj.notify()  # let other open dashboards see the new state
     
     response = {
         'status': session_obj.state,
         'current_orders': session_obj.get_current_orders(),
-        'confirmed_orders': session_obj.confirmed_orders,
-        'pending_orders': session_obj.pending_orders
+        'pending_orders': session_obj.pending_orders,
+        **_confirmed_orders_update(session_obj, data.get("rev"))
     }
     
     if result.get('message'):
@@ -1014,31 +1392,35 @@ def send_message():
 
 @app.route("/get_updates", methods=["POST"])
 def get_updates():
-    """Get updates including pending messages and session state"""
-    data = request.json
+    """Get updates including pending messages and session state.
+    
+    Polling fallback for /stream; bot messages only arrive here when Redis is off.
+    """
+    data = _request_json()
     user_id = data.get("user_id") or session.get('user_id', "default")
     
-    session_obj = get_user_session(user_id)
+    session_obj = get_user_session(user_id, data.get("session_id"))
     pending_message = session_obj.get_pending_message()
     
-    response = {
-        'state': session_obj.state,
-        'current_orders': session_obj.get_current_orders(),
-        'confirmed_orders': session_obj.confirmed_orders,
-        'pending_orders': session_obj.pending_orders,
-        'reminders_sent': session_obj.reminder_count,
-        'has_message': pending_message is not None
-    }
-    
-    if pending_message:
-        response['bot_message'] = pending_message
+    return jsonify(_session_payload(session_obj, pending_message, since=data.get("rev")))
+
+@app.route("/stream", methods=["GET"])
+def stream():
+    """Server-Sent Events feed of bot messages and session state (replaces polling /get_updates)"""
+    user_id = session.get('user_id', "default")
+    session_id = request.args.get("session_id")
+    session_obj = get_user_session(user_id, session_id)
     
-    return jsonify(response)
+    return Response(
+        stream_with_context(_stream_updates(session_obj)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 @app.route("/get_orders", methods=["GET"])
 def get_orders():
     user_id = request.args.get("user_id") or session.get('user_id', "default")
-    session_obj = get_user_session(user_id)
+    session_obj = get_user_session(user_id, request.args.get("session_id"))
     return jsonify({
         'current_orders': session_obj.get_current_orders(),
         'confirmed_orders': session_obj.confirmed_orders,
@@ -1048,57 +1430,35 @@ def get_orders():
 @app.route("/confirm_auto_order", methods=["POST"])
 def confirm_auto_order():
     """Move auto-confirmed order to main confirmed orders"""
-    data = request.json
+    data = _request_json()
     order_group = data.get("order_group")
     user_id = session.get('user_id', "default")
     
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    # Check if we're using PostgreSQL or SQLite
-    is_postgres = os.environ.get('DATABASE_URL') is not None
-    
-    if is_postgres:
+    with db_conn() as conn:
+        cur = conn.cursor()
         # Update status and order_group to move to main orders
-        cur.execute(
-            'UPDATE confirmed_orders SET status = %s, order_group = %s WHERE order_group = %s AND status = %s AND user_id = %s',
-            ('confirmed', 'main', order_group, 'auto_confirmed', user_id)
-        )
-    else:
-        cur.execute(
-            'UPDATE confirmed_orders SET status = ?, order_group = ? WHERE order_group = ? AND status = ? AND user_id = ?',
-            ('confirmed', 'main', order_group, 'auto_confirmed', user_id)
-        )
+        cur.execute(SQL_CONFIRM_AUTO_ORDER, ('confirmed', 'main', order_group, 'auto_confirmed', user_id))
+        conn.commit()
+        cur.close()
     
-    conn.commit()
-    cur.close()
-    conn.close()
+    _invalidate_orders(user_id)
     
     return jsonify({'success': True})
 
 @app.route("/delete_auto_order", methods=["POST"])
 def delete_auto_order():
     """Delete an auto-confirmed order group"""
-    data = request.json
+    data = _request_json()
     order_group = data.get("order_group")
     user_id = session.get('user_id', "default")
     
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    # Check if we're using PostgreSQL or SQLite
-    is_postgres = os.environ.get('DATABASE_URL') is not None
-    
-    if is_postgres:
-        cur.execute('DELETE FROM confirmed_orders WHERE order_group = %s AND status = %s AND user_id = %s', 
-                   (order_group, 'auto_confirmed', user_id))
-    else:
-        cur.execute('DELETE FROM confirmed_orders WHERE order_group = ? AND status = ? AND user_id = ?', 
-                   (order_group, 'auto_confirmed', user_id))
+    with db_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(SQL_DELETE_AUTO_ORDER, (order_group, 'auto_confirmed', user_id))
+        conn.commit()
+        cur.close()
     
-    conn.commit()
-    cur.close()
-    conn.close()
+    _invalidate_orders(user_id)
     
     return jsonify({'success': True})
 
@@ -1106,25 +1466,16 @@ def delete_auto_order():
 def download_excel():
     """Generate Excel file from database"""
     user_id = session.get('user_id', "default")
-    session_obj = get_user_session(user_id)
-    orders = session_obj.get_all_orders_summary()
+    orders = _fetch_orders(user_id)
     
     # Combine main orders and auto orders
-    all_orders = {}
-    for product, quantity in orders.get('main_orders', {}).items():
-        all_orders[product] = quantity
-    
-    for order_group, products in orders.get('auto_orders', {}).items():
-        for product, quantity in products.items():
-            if product in all_orders:
-                all_orders[product] += quantity
-            else:
-                all_orders[product] = quantity
+    all_orders = Counter(orders.get('main_orders', {}))
+    for products in orders.get('auto_orders', {}).values():
+        all_orders.update(products)
     
-    # Create Excel file in memory
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Pedidos"
+    # Create Excel file in memory (write-only mode streams rows to the file)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Pedidos")
     ws.append(["Produto", "Quantidade"])
     
     for product, quantity in all_orders.items():
@@ -1146,16 +1497,16 @@ def download_excel():
 def get_global_orders():
     """API endpoint to get global orders for AJAX updates"""
     user_id = session.get('user_id', "default")
-    session_obj = get_user_session(user_id)
-    global_orders = session_obj.get_global_orders()
-    return jsonify(global_orders)
+    return jsonify(_fetch_orders(user_id))
 
 @app.route("/reset_session", methods=["POST"])
 def reset_session():
     """Reset session manually"""
+    data = _request_json()
     user_id = session.get('user_id', "default")
-    session_obj = get_user_session(user_id)
-    session_obj.start_new_conversation()
+    session_obj = get_user_session(user_id, data.get("session_id"))
+    with locked_session(session_obj):
+        session_obj.start_new_conversation()
     
     return jsonify({'success': True})
 
@@ -1178,7 +1529,7 @@ def init_whatsapp_bot():
 @app.route('/qr_code', methods=['POST'])
 def handle_qr_code():
     """Store QR code for frontend display"""
-    data = request.json
+    data = _request_json()
     user_id = data.get('user_id')
     qr_code = data.get('qr_code')
     
@@ -1207,8 +1558,8 @@ def get_whatsapp_session():
 
 @app.route('/save_whatsapp_session', methods=['POST'])
 def save_whatsapp_session():
-    """Save WhatsApp session status"""
-    data = request.json
+    """Save WhatsApp session status (also updates users.whatsapp_ready)"""
+    data = _request_json()
     user_id = data.get('user_id')
     client_id = data.get('client_id')
     ready = data.get('ready', False)
@@ -1,27 +1,66 @@
 import psycopg2
+import psycopg2.pool
+import redis
 import os
+import threading
+import json
+import secrets
+from datetime import datetime
 from contextlib import contextmanager
 
+USER_CACHE_TTL = 60  # seconds a cached users row may be served from Redis
+
 class Database:
     def __init__(self):
         self.database_url = os.environ.get('DATABASE_URL')
-        self.init_db()
-    
-    @contextmanager
-    def get_connection(self):
+        
         # Fix for Render's PostgreSQL URL
         database_url = self.database_url
         if database_url and database_url.startswith("postgres://"):
             database_url = database_url.replace("postgres://", "postgresql://", 1)
         
-        conn = psycopg2.connect(database_url)
+        # One pool per process, shared with the order routes in app.py
+        maxconn = int(os.environ.get('PG_POOL_MAX', 20))
+        self.pool = psycopg2.pool.ThreadedConnectionPool(
+            minconn=2,
+            maxconn=maxconn,
+            dsn=database_url
+        )
+        # The pool raises PoolError when exhausted; make callers wait for a free slot instead
+        self._pool_slots = threading.BoundedSemaphore(maxconn)
+        
+        # Optional Redis cache for hot reads (users rows, order sessions)
+        redis_url = os.environ.get('REDIS_URL')
+        self.redis = redis.Redis.from_url(redis_url, decode_responses=True) if redis_url else None
+        self.init_db()
+    
+    def getconn(self):
+        """Borrow a pooled connection, blocking while all of them are in use"""
+        self._pool_slots.acquire()
+        try:
+            return self.pool.getconn()
+        except Exception:
+            self._pool_slots.release()
+            raise
+    
+    def putconn(self, conn):
+        """Give back a connection from getconn()"""
+        try:
+            self.pool.putconn(conn)
+        finally:
+            self._pool_slots.release()
+    
+    @contextmanager
+    def get_connection(self):
+        conn = self.getconn()
         try:
             yield conn
+            conn.commit()
         except Exception as e:
             conn.rollback()
             raise e
         finally:
-            conn.close()
+            self.putconn(conn)
     
     def init_db(self):
         with self.get_connection() as conn:
@@ -62,62 +101,92 @@ class Database:
                 ''')
             conn.commit()
     
-    def create_user(self, user_id, email):
-        with self.get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    'INSERT INTO users (id, email) VALUES (%s, %s)',
-                    (user_id, email)
-                )
-            conn.commit()
+    def _user_cache_key(self, user_id):
+        return f"u:{user_id}"
+    
+    def _invalidate_user(self, user_id):
+        if self.redis is not None:
+            self.redis.delete(self._user_cache_key(user_id))
+    
+    def _cache_user(self, user):
+        if self.redis is not None:
+            # created_at goes through ISO format so a cache hit returns a datetime too
+            created_at = user['created_at']
+            cached = {**user, 'created_at': created_at.isoformat() if created_at else None}
+            self.redis.setex(self._user_cache_key(user['id']), USER_CACHE_TTL, json.dumps(cached))
     
     def get_user(self, user_id):
+        if self.redis is not None:
+            raw = self.redis.get(self._user_cache_key(user_id))
+            if raw:
+                user = json.loads(raw)
+                if user['created_at']:
+                    user['created_at'] = datetime.fromisoformat(user['created_at'])
+                return user
+        
         with self.get_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute('SELECT * FROM users WHERE id = %s', (user_id,))
                 result = cur.fetchone()
                 if result:
-                    return {
+                    user = {
                         'id': result[0],
                         'email': result[1],
                         'whatsapp_ready': result[2],
                         'created_at': result[3]
                     }
+                    self._cache_user(user)
+                    return user
                 return None
     
-    def get_user_by_email(self, email):
+    def login_or_create(self, email):
+        """Fetch the user with this email, creating it if needed, in one round trip.
+        
+        Returns (user, created).
+        """
+        new_id = secrets.token_hex(16)
         with self.get_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute('SELECT * FROM users WHERE email = %s', (email,))
+                cur.execute('''
+                    INSERT INTO users (id, email) VALUES (%s, %s)
+                    ON CONFLICT (email) DO UPDATE SET email = EXCLUDED.email
+                    RETURNING id, email, whatsapp_ready, created_at
+                ''', (new_id, email))
                 result = cur.fetchone()
-                if result:
-                    return {
-                        'id': result[0],
-                        'email': result[1],
-                        'whatsapp_ready': result[2],
-                        'created_at': result[3]
-                    }
-                return None
+            conn.commit()
+        
+        user = {
+            'id': result[0],
+            'email': result[1],
+            'whatsapp_ready': result[2],
+            'created_at': result[3]
+        }
+        self._cache_user(user)  # the index page reads it right after login
+        return user, user['id'] == new_id
     
-    def update_whatsapp_status(self, user_id, ready):
+    def save_whatsapp_session(self, user_id, client_id, ready=False):
+        # users.whatsapp_ready mirrors the session row, so both change in one transaction
         with self.get_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute(
                     'UPDATE users SET whatsapp_ready = %s WHERE id = %s',
                     (ready, user_id)
                 )
+                if client_id is None:
+                    # Status-only update (the bot doesn't always resend its client id)
+                    cur.execute('''
+                        UPDATE whatsapp_sessions SET ready = %s, updated_at = CURRENT_TIMESTAMP
+                        WHERE user_id = %s
+                    ''', (ready, user_id))
+                else:
+                    cur.execute('''
+                        INSERT INTO whatsapp_sessions (user_id, client_id, ready) 
+                        VALUES (%s, %s, %s)
+                        ON CONFLICT (user_id) 
+                        DO UPDATE SET client_id = %s, ready = %s, updated_at = CURRENT_TIMESTAMP
+                    ''', (user_id, client_id, ready, client_id, ready))
             conn.commit()
-    
-    def save_whatsapp_session(self, user_id, client_id, ready=False):
-        with self.get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute('''
-                    INSERT INTO whatsapp_sessions (user_id, client_id, ready) 
-                    VALUES (%s, %s, %s)
-                    ON CONFLICT (user_id) 
-                    DO UPDATE SET client_id = %s, ready = %s, updated_at = CURRENT_TIMESTAMP
-                ''', (user_id, client_id, ready, client_id, ready))
-            conn.commit()
+        self._invalidate_user(user_id)
     
     def get_whatsapp_session(self, user_id):
         with self.get_connection() as conn:
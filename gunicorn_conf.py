@@ -0,0 +1,18 @@
+import os
+
+# Gunicorn settings for production (see render.yaml)
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# The bot is I/O-bound (PostgreSQL + WhatsApp webhooks), so one gevent worker
+# multiplexes many requests instead of blocking an OS thread per request.
+# Chat sessions live in process memory unless REDIS_URL is set, so only raise
+# WEB_CONCURRENCY above 1 together with Redis.
+worker_class = "gevent"
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+worker_connections = 1000
+
+
+def post_fork(server, worker):
+    # Make psycopg2 yield to other greenlets while waiting on the database
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()